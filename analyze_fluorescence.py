@@ -4,43 +4,123 @@ import pandas as pd
 import glob
 import os
 import re
+import pyarrow as pa
+import pyarrow.csv as pac
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from image_io import load_image
+from numba import njit
 from pathlib import Path
 
-def calculate_robust_mean(image_path):
+# Filename patterns (anchored like re.match)
+_SA_RE = re.compile(r'^T(\d+)_SA_(\d+)_(\d+)')   # T##_SA_##_#
+_CTR_RE = re.compile(r'^T(\d+)_Ctr_(\d+)')        # T##_Ctr_#
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _robust_mean_kernel(flat):
     """
-    Calculate the mean value after excluding the cropped outer area (black pixels) 
-    and the top/bottom 25% of intensities.
+    Mean of the non-zero values within their 25th-75th percentile range.
+    Returns (mean, number of pixels averaged); the mean is NaN if there are no
+    non-zero values, and falls back to the mean of all non-zero values (with a
+    count of 0) if none lie within the range.
     """
-    # Load image
-    img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    # Pass 1: locate the 25th/75th percentile values of the non-zero pixels
+    non_zero_pixels = flat[flat > 0]
+    n = non_zero_pixels.size
+    if n == 0:
+        return np.nan, 0
+    
+    # Sorted positions of the smallest value >= p25 and the largest value <= p75,
+    # where p25/p75 are np.percentile's (linearly interpolated) values
+    lo = (n + 2) // 4           # ceil((n - 1) / 4)
+    hi = 3 * (n - 1) // 4       # floor(3 * (n - 1) / 4)
+    part = np.partition(non_zero_pixels, lo)
+    p25 = part[lo]
+    if hi >= lo:
+        p75 = np.partition(part[lo:], hi - lo)[hi - lo]
+    else:
+        p75 = np.partition(part[:lo], hi)[hi]
+    
+    # Pass 2: sum/count of pixels within the 25th-75th percentile range
+    # (p25 >= 1, so the black outer area is excluded as well)
+    total = 0.0
+    count = 0
+    for i in range(flat.size):
+        value = flat[i]
+        if value >= p25 and value <= p75:
+            total += value
+            count += 1
+    
+    if count == 0:
+        return non_zero_pixels.astype(np.float64).mean(), 0
+    
+    return total / count, count
+
+def _load_grayscale_image(image_path):
+    """Load an image as a contiguous grayscale array (None if it cannot be loaded)."""
+    img = load_image(image_path)
     if img is None:
-        print(f"Could not load image: {image_path}")
         return None
     
-    # Convert to grayscale (if necessary)
+    # Convert to grayscale (if necessary; tifffile returns grayscale as 2-D)
     if len(img.shape) == 3:
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        try:
+            img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        except cv2.error as e:  # e.g. an unsupported number of channels
+            print(f"Could not convert image to grayscale: {image_path} ({e})")
+            return None
     
-    # Exclude the cropped outer area (black pixels, value=0)
-    non_zero_pixels = img[img > 0]
+    # Keep the image's own narrow dtype (e.g. uint16) in a contiguous,
+    # native-byte-order buffer so ravel() is a view and nothing is widened;
+    # only the final sum in the kernel is accumulated in float64
+    return np.ascontiguousarray(img, dtype=img.dtype.newbyteorder('='))
+
+def _robust_mean_of_image(img, image_path):
+    """Robust mean of an already loaded grayscale image (None if no valid pixels)."""
+    # Calculate robust mean after removing top/bottom 25%
+    robust_mean, count = _robust_mean_kernel(img.ravel())
     
-    if len(non_zero_pixels) == 0:
+    if np.isnan(robust_mean):
         print(f"No valid pixels found: {image_path}")
         return None
     
-    # Calculate robust mean after removing top/bottom 25%
-    p25 = np.percentile(non_zero_pixels, 25)
-    p75 = np.percentile(non_zero_pixels, 75)
+    if count == 0:
+        print(f"No pixels left after filtering: {image_path}")  # fell back to all non-zero pixels
     
-    # Select only pixels within the 25th-75th percentile range
-    filtered_pixels = non_zero_pixels[(non_zero_pixels >= p25) & (non_zero_pixels <= p75)]
+    return robust_mean
+
+def calculate_robust_mean(image_path):
+    """
+    Calculate the mean value after excluding the cropped outer area (black pixels) 
+    and the top/bottom 25% of intensities.
+    """
+    img = _load_grayscale_image(image_path)
+    if img is None:
+        return None
     
-    if len(filtered_pixels) == 0:
-        print(f"No pixels left after filtering: {image_path}")
-        return np.mean(non_zero_pixels)  # fallback to all non-zero pixels
+    return _robust_mean_of_image(img, image_path)
+
+def _calculate_robust_means(image_paths):
+    """
+    Calculate robust means for a batch of images (worker).
+    The next image is read on a background thread while the current one is
+    being reduced, so disk reads overlap with computation.
+    """
+    means = []
+    if not image_paths:
+        return means
     
-    robust_mean = np.mean(filtered_pixels)
-    return robust_mean
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        next_img = reader.submit(_load_grayscale_image, image_paths[0])
+        for i, image_path in enumerate(image_paths):
+            img = next_img.result()
+            
+            # Prefetch the next image
+            if i + 1 < len(image_paths):
+                next_img = reader.submit(_load_grayscale_image, image_paths[i + 1])
+            
+            means.append(None if img is None else _robust_mean_of_image(img, image_path))
+    
+    return means
 
 def parse_filename(filename):
     """
@@ -52,8 +132,7 @@ def parse_filename(filename):
     base_name = filename.replace('.tif', '')
     
     # SA pattern: T##_SA_##_#
-    sa_pattern = r'T(\d+)_SA_(\d+)_(\d+)'
-    sa_match = re.match(sa_pattern, base_name)
+    sa_match = _SA_RE.match(base_name)
     
     if sa_match:
         time_point = int(sa_match.group(1))
@@ -67,8 +146,7 @@ def parse_filename(filename):
         }
     
     # Ctr pattern: T##_Ctr_#
-    ctr_pattern = r'T(\d+)_Ctr_(\d+)'
-    ctr_match = re.match(ctr_pattern, base_name)
+    ctr_match = _CTR_RE.match(base_name)
     
     if ctr_match:
         time_point = int(ctr_match.group(1))
@@ -93,6 +171,43 @@ def time_point_to_string(time_point):
     mins = minutes % 60
     return f"{hours}:{mins:02d}"
 
+def parse_filenames(filenames):
+    """
+    Vectorized version of parse_filename for many filenames at once.
+    Returns a DataFrame with 'filename', 'time_point', 'sample_type', 'cfu' and
+    'replicate' columns; unrecognized filenames are reported and dropped
+    (the original positions are kept as the index).
+    """
+    names = pd.Series(filenames, dtype=object)
+    base_names = names.str.replace('.tif', '', regex=False)
+    
+    sa_parts = base_names.str.extract(_SA_RE)
+    ctr_parts = base_names.str.extract(_CTR_RE)
+    is_sa = sa_parts[0].notna()
+    recognized = is_sa | ctr_parts[0].notna()
+    
+    for filename in names[~recognized]:
+        print(f"Could not recognize filename pattern: {filename}")
+    
+    file_info = pd.DataFrame({
+        'filename': names,
+        'time_point': sa_parts[0].fillna(ctr_parts[0]),
+        'sample_type': np.where(is_sa, 'SA', 'Ctr'),
+        'cfu': sa_parts[1].fillna('0'),
+        'replicate': sa_parts[2].fillna(ctr_parts[1]),
+    })[recognized]
+    
+    # Compact dtypes: integer codes for sample_type, int32 for the rest
+    return file_info.astype({'time_point': 'int32', 'sample_type': 'category',
+                             'cfu': 'int32', 'replicate': 'int32'})
+
+def time_points_to_strings(time_points):
+    """Vectorized version of time_point_to_string for an integer Series."""
+    minutes = (time_points.astype(np.int64) - 1) * 30
+    hours = minutes // 60
+    mins = minutes % 60
+    return hours.astype(str) + ':' + mins.astype(str).str.zfill(2)
+
 def process_circle_images():
     """Process all images in the 'circle' folder and save to CSV."""
     # Image file path
@@ -105,51 +220,59 @@ def process_circle_images():
     
     print(f"Analyzing {len(image_files)} images in total...")
     
-    # List to store results
-    results = []
+    # Parse all filenames at once
+    file_info = parse_filenames([os.path.basename(path) for path in image_files])
+    file_info['time_str'] = time_points_to_strings(file_info['time_point'])
+    image_paths = [image_files[i] for i in file_info.index]
     
-    for i, image_path in enumerate(image_files, 1):
-        filename = os.path.basename(image_path)
-        
-        # Parse filename
-        file_info = parse_filename(filename)
-        if file_info is None:
-            continue
-        
-        # Calculate robust mean
-        mean_value = calculate_robust_mean(image_path)
-        if mean_value is None:
-            continue
-        
-        # Convert time point to string
-        time_str = time_point_to_string(file_info['time_point'])
-        
-        # Save result
-        results.append({
-            'filename': filename,
-            'time_str': time_str,
-            'sample_type': file_info['sample_type'],
-            'cfu': file_info['cfu'],
-            'replicate': file_info['replicate'],
-            'mean_intensity': round(mean_value, 2)
-        })
-        
-        # Print progress
-        if i % 50 == 0:
-            print(f"Progress: {i}/{len(image_files)} ({i/len(image_files)*100:.1f}%)")
+    # Images are independent, so calculate robust means in parallel
+    # (preallocated; NaN marks images without a valid robust mean)
+    mean_values = np.full(len(image_paths), np.nan)
+    batch_size = 16
+    batches = [image_paths[j:j + batch_size] for j in range(0, len(image_paths), batch_size)]
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        i = 0
+        for batch_means in executor.map(_calculate_robust_means, batches):
+            for mean_value in batch_means:
+                if mean_value is not None:
+                    mean_values[i] = mean_value
+                i += 1
+                
+                # Print progress
+                if i % 50 == 0:
+                    print(f"Progress: {i}/{len(image_paths)} ({i/len(image_paths)*100:.1f}%)")
+    
+    file_info['mean_intensity'] = np.round(mean_values, 2)
     
-    # Create and sort DataFrame
-    df = pd.DataFrame(results)
+    # Keep only images with a valid robust mean
+    df = file_info[file_info['mean_intensity'].notna()]
     
     # Sort by time, sample_type, cfu, and replicate
-    df_sorted = df.sort_values(['time_str', 'sample_type', 'cfu', 'replicate']).reset_index(drop=True)
+    # (lexsort on integer keys; the last key is the primary one)
+    order = np.lexsort((df['replicate'].values,
+                        df['cfu'].values,
+                        df['sample_type'].cat.codes.values,
+                        df['time_point'].values))
+    df_sorted = df.iloc[order].reset_index(drop=True)
+    df_sorted = df_sorted[['filename', 'time_str', 'sample_type', 'cfu', 'replicate', 'mean_intensity']]
     
     # Save to CSV file
     output_file = "fluorescence_analysis.csv"
-    df_sorted.to_csv(output_file, index=False, encoding='utf-8-sig')
+    # Format mean_intensity like to_csv did (Arrow drops the '.0' of whole numbers)
+    table = pa.Table.from_pandas(df_sorted.astype({'sample_type': str, 'mean_intensity': str}),
+                                 preserve_index=False)
+    # Write values unquoted like to_csv did, unless a filename contains a
+    # delimiter, quote or newline (Arrow then has to quote string values)
+    needs_quoting = df_sorted['filename'].str.contains('[,"\r\n]').any()
+    quoting_style = 'needed' if needs_quoting else 'none'
+    with open(output_file, 'wb') as f:
+        f.write(b'\xef\xbb\xbf')  # UTF-8 BOM so Excel detects the encoding
+        # Arrow quotes header names regardless, so write the header here
+        f.write((','.join(table.column_names) + '\n').encode('utf-8'))
+        pac.write_csv(table, f, pac.WriteOptions(include_header=False, quoting_style=quoting_style))
     
     print(f"\nAnalysis complete!")
-    print(f"Processed images: {len(results)}")
+    print(f"Processed images: {len(df)}")
     print(f"Saved to: {output_file}")
     print(f"CSV file size: {len(df_sorted)} rows")
     
@@ -178,16 +301,16 @@ def test_single_image():
         print(f"Test image: {filename}")
         
         # Test filename parsing
-        file_info = parse_filename(filename)
-        print(f"Parsing result: {file_info}")
+        file_info = parse_filenames([filename])
+        print(f"Parsing result: {file_info.to_dict('records')}")
         
         # Test robust mean calculation
         mean_value = calculate_robust_mean(test_file)
         print(f"Robust mean: {mean_value}")
         
         # Test time conversion
-        if file_info:
-            time_str = time_point_to_string(file_info['time_point'])
+        if len(file_info) > 0:
+            time_str = time_points_to_strings(file_info['time_point']).iloc[0]
             print(f"Time string: {time_str}")
 
 if __name__ == "__main__":
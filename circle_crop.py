@@ -1,7 +1,10 @@
-import cv2
 import numpy as np
 import os
 import glob
+import tifffile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from image_io import load_image
 from pathlib import Path
 
 def create_circular_mask(h, w, center=None, radius=None):
@@ -12,48 +15,57 @@ def create_circular_mask(h, w, center=None, radius=None):
         radius = min(center[0], center[1], w-center[0], h-center[1])
     
     Y, X = np.ogrid[:h, :w]
-    dist_from_center = np.sqrt((X - center[0])**2 + (Y-center[1])**2)
+    X = X.astype(np.int32, copy=False) - center[0]
+    Y = Y.astype(np.int32, copy=False) - center[1]
     
-    mask = dist_from_center <= radius
+    # Compare squared distance to avoid the sqrt and a float64 temporary
+    dist2_from_center = X * X + Y * Y
+    
+    mask = dist2_from_center <= radius * radius
     return mask
 
+@lru_cache(maxsize=8)
+def _cached_mask(h, w):
+    """Create the circular mask for the cropped square once per image size (outside area, radius, center)."""
+    # Calculate center point
+    center_x, center_y = w // 2, h // 2
+    
+    # Calculate maximum radius (largest size that doesn't touch the image boundary)
+    radius = min(center_x, center_y, w - center_x, h - center_y)
+    
+    # Mask is sized to the (2r, 2r) bounding square of the circle
+    size = 2 * radius
+    outside_mask = ~create_circular_mask(size, size, center=(radius, radius), radius=radius)
+    outside_mask.flags.writeable = False  # shared between calls
+    return outside_mask, radius, center_x, center_y
+
 def crop_circle_from_image(image_path, output_path):
     """Crop the largest possible circular area from the center of the image and save it."""
     # Load image
-    img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    img = load_image(image_path)
     if img is None:
-        print(f"Could not load image: {image_path}")
         return False
     
     h, w = img.shape[:2]
     
-    # Calculate center point
-    center_x, center_y = w // 2, h // 2
-    
-    # Calculate maximum radius (largest size that doesn't touch the image boundary)
-    radius = min(center_x, center_y, w - center_x, h - center_y)
-    
-    # Create circular mask
-    mask = create_circular_mask(h, w, center=(center_x, center_y), radius=radius)
+    # Circular mask (reused across images of the same size)
+    outside_mask, radius, center_x, center_y = _cached_mask(h, w)
     
-    # Apply mask
-    if len(img.shape) == 3:  # Color image
-        masked_img = img.copy()
-        masked_img[~mask] = 0  # Set area outside the mask to black
-    else:  # Grayscale image
-        masked_img = img.copy()
-        masked_img[~mask] = 0
-    
-    # Crop only the circular area (bounding box)
+    # Crop only the circular area (bounding box) first, so the mask is
+    # applied to the small square rather than the full image
     crop_x1 = center_x - radius
     crop_y1 = center_y - radius
     crop_x2 = center_x + radius
     crop_y2 = center_y + radius
     
-    cropped_img = masked_img[crop_y1:crop_y2, crop_x1:crop_x2]
+    # img is loaded only for this function, so mask the view in place (no copy)
+    cropped_img = img[crop_y1:crop_y2, crop_x1:crop_x2]
+    
+    # Apply mask (works for both color and grayscale images)
+    cropped_img[outside_mask] = 0  # Set area outside the mask to black
     
-    # Save
-    cv2.imwrite(output_path, cropped_img)
+    # Save (LZW with horizontal predictor, like cv2.imwrite)
+    tifffile.imwrite(output_path, cropped_img, compression='lzw', predictor=True)
     return True
 
 def process_all_images():
@@ -77,19 +89,20 @@ def process_all_images():
     processed_count = 0
     failed_count = 0
     
-    for i, image_path in enumerate(image_files, 1):
-        # Extract filename
-        filename = os.path.basename(image_path)
-        output_path = os.path.join(output_dir, filename)
-        
-        # Process image
-        if crop_circle_from_image(image_path, output_path):
-            processed_count += 1
-            if i % 50 == 0:  # Print progress every 50 images
-                print(f"Progress: {i}/{len(image_files)} ({i/len(image_files)*100:.1f}%)")
-        else:
-            failed_count += 1
-            print(f"Processing failed: {filename}")
+    # Output paths for each image
+    output_paths = [os.path.join(output_dir, os.path.basename(path)) for path in image_files]
+    
+    # Images are independent, so process them in parallel
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        outcomes = executor.map(crop_circle_from_image, image_files, output_paths, chunksize=16)
+        for i, (image_path, success) in enumerate(zip(image_files, outcomes), 1):
+            if success:
+                processed_count += 1
+                if i % 50 == 0:  # Print progress every 50 images
+                    print(f"Progress: {i}/{len(image_files)} ({i/len(image_files)*100:.1f}%)")
+            else:
+                failed_count += 1
+                print(f"Processing failed: {os.path.basename(image_path)}")
     
     print(f"\nProcessing complete!")
     print(f"Succeeded: {processed_count}")
@@ -110,8 +123,8 @@ def test_single_image():
             print(f"Test successful: {output_path}")
             
             # Print info for original and cropped images
-            original = cv2.imread(test_file, cv2.IMREAD_UNCHANGED)
-            cropped = cv2.imread(output_path, cv2.IMREAD_UNCHANGED)
+            original = load_image(test_file)
+            cropped = load_image(output_path)
             
             print(f"Original size: {original.shape}")
             print(f"Cropped size: {cropped.shape}")
@@ -0,0 +1,10 @@
+import tifffile
+
+def load_image(image_path):
+    """Load the first page of a TIFF image (None if it cannot be loaded)."""
+    try:
+        # First page only, as with cv2.imread (tifffile would stack all pages)
+        return tifffile.imread(image_path, key=0)
+    except Exception as e:  # any unreadable file is skipped, as with cv2.imread
+        print(f"Could not load image: {image_path} ({e})")
+        return None
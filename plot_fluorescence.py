@@ -19,24 +19,25 @@ def plot_fluorescence_data(csv_file='fluorescence_analysis.csv', output_basename
         return
 
     # 1. Load and preprocess data
-    df = pd.read_csv(csv_file)
-    df['time_hours'] = df['time_str'].apply(convert_time_to_hours)
+    df = pd.read_csv(csv_file, dtype={'sample_type': 'category', 'cfu': 'int32'})
+    # Vectorized 'h:mm' -> decimal hours (same as convert_time_to_hours; NaN if malformed)
+    time_parts = df['time_str'].astype(str).str.split(':', n=1, expand=True).reindex(columns=[0, 1])
+    df['time_hours'] = (pd.to_numeric(time_parts[0], errors='coerce')
+                        + pd.to_numeric(time_parts[1], errors='coerce') / 60.0)
 
     # Calculate hourly mean for Ctr data
-    ctr_mean = df[df['sample_type'] == 'Ctr'].groupby('time_hours')['mean_intensity'].mean().reset_index()
-    ctr_mean.rename(columns={'mean_intensity': 'Ctr_mean'}, inplace=True)
+    ctr_mean = df[df['sample_type'] == 'Ctr'].groupby('time_hours')['mean_intensity'].mean()
 
     # Filter SA data only
-    sa_df = df[df['sample_type'] == 'SA'].copy()
-    
-    # Merge Ctr mean into SA data
-    merged_df = pd.merge(sa_df, ctr_mean, on='time_hours', how='left')
+    sa_mask = df['sample_type'].values == 'SA'
+    sa_df = df.loc[sa_mask, ['time_hours', 'cfu', 'mean_intensity']]
 
-    # Calculate Δ Intensity
-    merged_df['delta_intensity'] = merged_df['mean_intensity'] - merged_df['Ctr_mean']
+    # Calculate Δ Intensity against the Ctr mean at the same time point
+    delta_intensity = pd.Series(sa_df['mean_intensity'].values - sa_df['time_hours'].map(ctr_mean).values,
+                                index=sa_df.index, name='delta_intensity')
 
     # 2. Aggregate data for plotting
-    plot_data = merged_df.groupby(['time_hours', 'cfu'])['delta_intensity'].agg(['mean', 'std']).reset_index()
+    plot_data = delta_intensity.groupby([sa_df['time_hours'], sa_df['cfu']], sort=True).agg(['mean', 'std']).reset_index()
 
     # 3. Plotting
     plt.style.use('seaborn-v0_8-whitegrid')
@@ -94,7 +95,7 @@ def plot_fluorescence_data(csv_file='fluorescence_analysis.csv', output_basename
     plt.tight_layout()
 
     output_formats = {
-        'png': {'dpi': 300},
+        'png': {'dpi': 300, 'pil_kwargs': {'compress_level': 1}},  # fast zlib level
         'svg': {},
         'pdf': {}
     }
@@ -102,7 +103,7 @@ def plot_fluorescence_data(csv_file='fluorescence_analysis.csv', output_basename
     saved_files = []
     for fmt, options in output_formats.items():
         filename = f"{output_basename}.{fmt}"
-        plt.savefig(filename, **options)
+        fig.savefig(filename, **options)
         saved_files.append(filename)
     
     print(f"Plot saved to the following files: {', '.join(saved_files)}")